@@ -163,6 +163,10 @@ def main():
 
     parser.add_argument("--adapters", nargs='*', default=(),
                         help="List of pre-loaded LoRA adapters that can be used for inference or training")
+    parser.add_argument("--compile_blocks", action='store_true',
+                        help="Experimental: wrap each block's inference forward (not forward/backward) in "
+                             "torch.compile (requires torch>=2.0). The FlexGen block's host-side offloading causes "
+                             "many graph breaks, so this is not guaranteed to be faster or to work for every model")
 
     # fmt:on
     args = vars(parser.parse_args())
@@ -36,15 +36,13 @@ class Policy:
     compress_cache: bool
     comp_cache_config: CompressionConfig
 
-    @property
-    def w_disk_percent(self):
-        return 100 - self.w_gpu_percent - self.w_cpu_percent
-
-    @property
-    def cache_disk_percent(self):
-        return 100 - self.cache_gpu_percent - self.cache_cpu_percent
-
-    @property
-    def act_disk_percent(self):
-        return 100 - self.act_gpu_percent - self.act_cpu_percent
-
+    # Derived from the percentages above in __post_init__, since they are read in per-layer placement decisions
+    w_disk_percent: float = dataclasses.field(init=False)
+    cache_disk_percent: float = dataclasses.field(init=False)
+    act_disk_percent: float = dataclasses.field(init=False)
+
+    def __post_init__(self):
+        # the dataclass is frozen, so derived fields have to bypass __setattr__
+        object.__setattr__(self, "w_disk_percent", 100 - self.w_gpu_percent - self.w_cpu_percent)
+        object.__setattr__(self, "cache_disk_percent", 100 - self.cache_gpu_percent - self.cache_cpu_percent)
+        object.__setattr__(self, "act_disk_percent", 100 - self.act_gpu_percent - self.act_cpu_percent)
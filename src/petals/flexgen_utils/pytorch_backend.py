@@ -33,14 +33,14 @@ def fix_recursive_import():
     general_copy_compressed = compression.general_copy_compressed
     TorchCompressedDevice = compression.TorchCompressedDevice
 from pynvml import *
+from petals.memory_usage import get_nvml_handle
 
 def see_memory_usage(message, force=True):
 	logger = ''
 	logger += message
-	nvmlInit()
  
 	# nvidia_smi.nvmlInit()
-	handle = nvmlDeviceGetHandleByIndex(0)
+	handle = get_nvml_handle()
 	info = nvmlDeviceGetMemoryInfo(handle)
 	logger += "\n Nvidia-smi: " + str((info.used) / 1024 / 1024 / 1024) + " GB"
 	
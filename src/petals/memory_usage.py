@@ -1,11 +1,23 @@
+import atexit
+import functools
+
 import torch
-from pynvml.smi import nvidia_smi
 from pynvml import *
 
+@functools.lru_cache(maxsize=1)
+def _init_nvml():
+	nvmlInit()
+	atexit.register(nvmlShutdown)
+
+@functools.lru_cache(maxsize=None)
+def get_nvml_handle(index=0):
+	# NVML only needs to be initialized once per process, and device handles never change
+	_init_nvml()
+	return nvmlDeviceGetHandleByIndex(index)
+
 def nvidia_smi_usage():
 	logger = ''
-	nvmlInit()
-	handle = nvmlDeviceGetHandleByIndex(0)
+	handle = get_nvml_handle()
 	info = nvmlDeviceGetMemoryInfo(handle)
 	# logger += "\n Nvidia-smi: " + str((info.used) / 1024 / 1024 / 1024) + " GB"
 	return (info.used) / 1024 / 1024 / 1024
@@ -13,10 +25,9 @@ def nvidia_smi_usage():
 def see_memory_usage(message, force=True):
 	logger = ''
 	logger += message
-	nvmlInit()
 
 	# nvidia_smi.nvmlInit()
-	handle = nvmlDeviceGetHandleByIndex(0)
+	handle = get_nvml_handle()
 	info = nvmlDeviceGetMemoryInfo(handle)
 	logger += "\n Nvidia-smi: " + str((info.used) / 1024 / 1024 / 1024) + " GB"
 	# logger += message
@@ -45,14 +45,14 @@ fix_recursive_import()
 # import torch
 # from pynvml.smi import nvidia_smi
 from pynvml import *
+from petals.memory_usage import get_nvml_handle
 
 def see_memory_usage(message, force=True):
 	logger = ''
 	logger += message
-	nvmlInit()
  
 	# nvidia_smi.nvmlInit()
-	handle = nvmlDeviceGetHandleByIndex(0)
+	handle = get_nvml_handle()
 	info = nvmlDeviceGetMemoryInfo(handle)
 	logger += "\n Nvidia-smi: " + str((info.used) / 1024 / 1024 / 1024) + " GB"
 	
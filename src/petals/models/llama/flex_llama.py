@@ -91,14 +91,14 @@ class Policy:
         return 100 - self.act_gpu_percent - self.act_cpu_percent
 
 from pynvml import *
+from petals.memory_usage import get_nvml_handle
 
 def see_memory_usage(message, force=True):
 	logger = ''
 	logger += message
-	nvmlInit()
  
 	# nvidia_smi.nvmlInit()
-	handle = nvmlDeviceGetHandleByIndex(0)
+	handle = get_nvml_handle()
 	info = nvmlDeviceGetMemoryInfo(handle)
 	logger += "\n Nvidia-smi: " + str((info.used) / 1024 / 1024 / 1024) + " GB"
 	
@@ -1,11 +1,10 @@
 import torch
-from pynvml.smi import nvidia_smi
 from pynvml import *
+from petals.memory_usage import get_nvml_handle
 
 def nvidia_smi_usage():
 	logger = ''
-	nvmlInit()
-	handle = nvmlDeviceGetHandleByIndex(0)
+	handle = get_nvml_handle()
 	info = nvmlDeviceGetMemoryInfo(handle)
 	# logger += "\n Nvidia-smi: " + str((info.used) / 1024 / 1024 / 1024) + " GB"
 	return (info.used) / 1024 / 1024 / 1024
@@ -13,10 +12,9 @@ def nvidia_smi_usage():
 def see_memory_usage(message, force=True):
 	logger = ''
 	logger += message
-	nvmlInit()
 
 	# nvidia_smi.nvmlInit()
-	handle = nvmlDeviceGetHandleByIndex(0)
+	handle = get_nvml_handle()
 	info = nvmlDeviceGetMemoryInfo(handle)
 	logger += "\n Nvidia-smi: " + str((info.used) / 1024 / 1024 / 1024) + " GB"
 	# logger += message
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import math
 from collections import Counter
 from itertools import chain
 from typing import Any, Dict, Optional, Sequence, Tuple, Union
@@ -25,6 +26,15 @@ import safetensors
 logger = get_logger(__name__)
 
 
+def _copy_tensors_(dst: Sequence[torch.Tensor], src: Sequence[torch.Tensor]):
+    """Copy each src tensor into the matching dst tensor, batching the kernel launches if torch supports it"""
+    if hasattr(torch, "_foreach_copy_"):
+        torch._foreach_copy_(dst, src)
+    else:
+        for dst_tensor, src_tensor in zip(dst, src):
+            dst_tensor.copy_(src_tensor)
+
+
 class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Module
     """A wrapper for a transformer block that can process requests for forward, backward and inference"""
 
@@ -37,16 +47,23 @@ class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Mo
         memory_cache: MemoryCache,
         backend_dtype: torch.dtype,
         max_chunk_size_bytes: int,
+        compile_forward: bool = False,
         weights_path: str = '/tmp/data/llama_weights',
         **kwargs,
     ):
-        import petals.utils.peft as _peft_module
+        if TransformerBackend._peft_module is None:
+            import petals.utils.peft as _peft_module
 
-        self._peft_module = _peft_module
+            TransformerBackend._peft_module = _peft_module  # shared by all backends, see forward/backward
         self.path = weights_path
 
         super().__init__(*args, **kwargs)
         assert isinstance(self.module, TensorParallel)
+        self._module_forward = self.module.forward
+        if compile_forward:
+            assert hasattr(torch, "compile"), "compiling blocks requires torch>=2.0"
+            # experimental, only used by inference_step; dynamic=True avoids recompiling for every new shape
+            self._module_forward = torch.compile(self.module.forward, dynamic=True)
         self.config = config
         self.memory_cache = memory_cache
         self.max_chunk_size_bytes = max_chunk_size_bytes
@@ -72,9 +89,10 @@ class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Mo
         self.dtype_bytes = get_size_in_bytes(self.dtype)
         self.shard_num_heads = []
         for shard in self.module.module_shards:
-            for submodule in shard.modules():
-                if isinstance(submodule, config.attn_class):
-                    self.shard_num_heads.append(submodule.num_heads)
+            # each shard is a single block with one attention module, so stop traversing as soon as we find it
+            attn = next((submodule for submodule in shard.modules() if isinstance(submodule, config.attn_class)), None)
+            if attn is not None:
+                self.shard_num_heads.append(attn.num_heads)
         assert len(self.shard_num_heads) == len(self.module.devices)
         assert sum(self.shard_num_heads) == config.num_attention_heads
 
@@ -89,7 +107,8 @@ class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Mo
 
         self.cache_bytes_per_token: Dict[torch.device, int] = Counter()
         for descr in self.get_inference_cache_descriptors(batch_size=1, max_length=1):
-            self.cache_bytes_per_token[descr.device] += descr.numel() * get_size_in_bytes(descr.dtype)
+            # all cache descriptors are allocated in self.dtype, see get_inference_cache_descriptors
+            self.cache_bytes_per_token[descr.device] += math.prod(descr.shape) * self.dtype_bytes
 
     def get_inference_cache_descriptors(self, batch_size: int, max_length: int) -> Sequence[TensorDescriptor]:
         """Create tensor descriptors for attention cache tensors used during inference_step"""
@@ -99,7 +118,7 @@ class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Mo
             num_heads //= self.config.num_key_value_groups
             if hasattr(self.config, "num_key_value_heads"):
                 num_heads = self.config.num_key_value_heads
-            keys = TensorDescriptor((batch_size, num_heads, head_dim, max_length), dtype=self.dtype, device=device)
+            keys = TensorDescriptor((batch_size, num_heads, max_length, head_dim), dtype=self.dtype, device=device)
             values = TensorDescriptor((batch_size, num_heads, max_length, head_dim), dtype=self.dtype, device=device)
             cache_tensors.extend((keys, values))
         return cache_tensors
@@ -122,34 +141,14 @@ class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Mo
         inference_info: Optional[InferenceInfo] = None,
     ) -> Tuple[torch.Tensor, ...]:
         """Run a single inference step."""
-        logger.info(f"Input shape: {hidden_states.shape}, dtype: {hidden_states.dtype}")
-        logger.info(f"Sequence length: {hidden_states.size(1)}")
-
-        # Ensure hidden states are 3D
-        if hidden_states.ndim == 2:
-            hidden_states = hidden_states.unsqueeze(0)
-
-        # Process hidden states in chunks to reduce memory usage
-        chunk_size = 512  # Adjust based on available memory
-        n_chunks = (hidden_states.size(1) + chunk_size - 1) // chunk_size
-        output_chunks = []
-
-        for i in range(n_chunks):
-            start_idx = i * chunk_size
-            end_idx = min((i + 1) * chunk_size, hidden_states.size(1))
-            chunk = hidden_states[:, start_idx:end_idx, :]
-            
-            # Process each chunk
-            output_chunk = self.module.forward(chunk, use_cache=True)
-            output_chunks.append(output_chunk[0])
-            
-            # Clear cache after each chunk
-            torch.cuda.empty_cache()
-        
-        # Concatenate chunks
-        output_hidden_states = torch.cat(output_chunks, dim=1)
-        
-        logger.info(f"Output shape: {output_hidden_states.shape}")
+        logger.debug("Input shape: %s, dtype: %s", hidden_states.shape, hidden_states.dtype)
+        assert hidden_states.ndim == 3, "expected hidden states to be 3-dimensional: [batch_size, seq_len, hid_size]"
+
+        # note: the FlexGen block keeps its own KV cache and does not receive layer_past, so the whole step must go
+        # through a single forward call; splitting it into chunks would make each chunk lose the previous ones
+        output_hidden_states = self._module_forward(hidden_states, use_cache=True)[0]
+
+        logger.debug("Output shape: %s", output_hidden_states.shape)
         return (output_hidden_states,)
 
     def _estimate_max_chunk_length(self, hidden_states: torch.Tensor, inference_info: InferenceMetadata) -> int:
@@ -160,18 +159,25 @@ class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Mo
         attn_bytes_per_token = max(self.shard_num_heads) * batch_size * self.dtype_bytes * worst_case_length
         return max(1, self.max_chunk_size_bytes // attn_bytes_per_token)
 
+    # note: the cache helpers below are not called by inference_step at the moment, since the FlexGen block
+    # keeps its own KV cache; they are kept (and tested) for when MemoryCache-backed caching is reconnected
+
     def _reorder_cache_inplace(self, cache_tensors: torch.Tensor, hypo_ids: torch.Tensor):
         """If hypo_ids is specified, reorder elements of each cache tensor in-place by taking indices from hypo_ids"""
         if not is_dummy(hypo_ids):
+            hypo_ids_by_device = {}
             for cache_tensor in cache_tensors:
-                cache_tensor[...] = cache_tensor[hypo_ids.to(cache_tensor.device)]  # in-place reorder cache by hypo ids
+                if cache_tensor.device not in hypo_ids_by_device:
+                    hypo_ids_by_device[cache_tensor.device] = hypo_ids.to(cache_tensor.device, non_blocking=True)
+                gathered = cache_tensor.index_select(0, hypo_ids_by_device[cache_tensor.device])
+                cache_tensor.copy_(gathered)  # in-place reorder cache by hypo ids
 
     def _select_layer_past(self, cache_tensors: Sequence[torch.Tensor], prefix_length: int) -> Sequence[torch.Tensor]:
         """Extract first {prefix_length} tokens and reshape them such that they can be used as layer_past"""
         key_cache, value_cache = list(cache_tensors[0::2]), list(cache_tensors[1::2])
         for i in range(len(key_cache)):
-            key_cache[i] = key_cache[i].flatten(0, 1)[:, :, :prefix_length]
-            # shape: [batch * num_kv_heads, head_dim, kv_length]
+            key_cache[i] = key_cache[i].flatten(0, 1)[:, :prefix_length].transpose(1, 2)
+            # shape: [batch * num_kv_heads, head_dim, kv_length] (stored as [..., kv_length, head_dim], like values)
             value_cache[i] = value_cache[i].flatten(0, 1)[:, :prefix_length]
             # shape: [batch * num_kv_heads, kv_length, head_dim]
         layer_past = tuple(chain(*zip(key_cache, value_cache)))
@@ -182,12 +188,16 @@ class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Mo
     ):
         """Writes new key/value tensors back into cache, works in-place"""
         _batch_size_times_num_kv_heads, head_dim, new_length = new_kvs[0].shape
+        cache_slices, new_slices = [], []
         for cache_key, new_key in zip(cache_tensors[0::2], new_kvs[0::2]):
-            new_key = new_key.view(*cache_key.shape[:3], new_length)
-            cache_key[:, :, :, prefix_length:new_length] = new_key[:, :, :, prefix_length:new_length]
+            new_key = new_key.view(*cache_key.shape[:2], head_dim, new_length).transpose(2, 3)
+            cache_slices.append(cache_key[:, :, prefix_length:new_length, :])
+            new_slices.append(new_key[:, :, prefix_length:new_length, :])
         for cache_value, new_value in zip(cache_tensors[1::2], new_kvs[1::2]):
             new_value = new_value.view(*cache_value.shape[:2], new_length, head_dim)
-            cache_value[:, :, prefix_length:new_length, :] = new_value[:, :, prefix_length:new_length, :]
+            cache_slices.append(cache_value[:, :, prefix_length:new_length, :])
+            new_slices.append(new_value[:, :, prefix_length:new_length, :])
+        _copy_tensors_(cache_slices, new_slices)
 
     def get_pools(self) -> Sequence[PrioritizedTaskPool]:
         return self.forward_pool, self.backward_pool, self.inference_pool
@@ -204,13 +214,12 @@ class TransformerBackend(ModuleBackend): # hivemind: ModuleBackend.module: nn.Mo
         # but may help to avoid future issues when the module is not garbage-collected for some reasons
         for p in self.module.parameters():
             if not p.is_meta:
-                p.data = torch.empty_like(p.data, device='cpu')
+                p.data = torch.empty(0, dtype=p.dtype, device="cpu")  # do not allocate a full-size CPU copy
 
 
 def merge_inference_pools_inplace(backends: Dict[ExpertUID, TransformerBackend]):
     """Replace each backend's rpc_inference pools with a combined pool runs multiple blocks in one call"""
     assert len(backends) != 0 and all(isinstance(b, TransformerBackend) for b in backends.values())
-    print('............... come into the merge_inference_pools_inplace() ' )
     first_pool = next(iter(backends.values())).inference_pool
     merged_pool = PrioritizedTaskPool(
         _MergedInferenceStep(backends),
@@ -238,11 +247,9 @@ class _MergedInferenceStep:
         assert len(inference_infos) == len(
             optional_prompts
         ), f"found {len(inference_infos)} blocks but {len(optional_prompts)} prompts"
-        print('............... come into the _MergedInferenceStep __call__' )
         for inference_info, optional_prompt in zip(inference_infos, optional_prompts):
             if optional_prompt is not None:
                 hidden_states[:, : optional_prompt.shape[1]] += optional_prompt
-            print('............... come into the _MergedInferenceStep __call__ inference_info.uid ', inference_info.uid)
             (hidden_states,) = self.backends[inference_info.uid].inference_step(hidden_states, hypo_ids, inference_info)
         # import pdb; pdb.set_trace()
         return (hidden_states,)
@@ -24,6 +24,7 @@ from transformers import PretrainedConfig
 import petals
 from petals.constants import DTYPE_MAP, PUBLIC_INITIAL_PEERS
 from petals.data_structures import CHAIN_DELIMITER, UID_DELIMITER, ModelInfo, ServerInfo, ServerState, parse_uid
+from petals.memory_usage import get_nvml_handle
 from petals.server import block_selection
 from petals.server.backend import TransformerBackend, merge_inference_pools_inplace
 from petals.server.block_utils import get_block_size, resolve_block_dtype
@@ -50,10 +51,9 @@ from pynvml import *
 def see_memory_usage(message, force=True):
 	logger = ''
 	logger += message
-	nvmlInit()
  
 	# nvidia_smi.nvmlInit()
-	handle = nvmlDeviceGetHandleByIndex(0)
+	handle = get_nvml_handle()
 	info = nvmlDeviceGetMemoryInfo(handle)
 	logger += f"\nNvidia-smi: {(info.used) / 1024 / 1024 / 1024:.2f} GB"
 	logger += f"\nCUDA Allocated: {torch.cuda.memory_allocated() / (1024 * 1024 * 1024):.2f} GB"
@@ -114,6 +114,7 @@ class Server:
         use_relay: bool = True,
         use_auto_relay: bool = True,
         adapters: Sequence[str] = (),
+        compile_blocks: bool = False,
         **kwargs,
     ):
         """Create a server with one or more bloom blocks. See run_server.py for documentation."""
@@ -223,6 +224,7 @@ class Server:
         self.inference_max_length = inference_max_length
         self.max_chunk_size_bytes = max_chunk_size_bytes
         self.max_alloc_timeout = max_alloc_timeout
+        self.compile_blocks = compile_blocks
 
         # For attention cache in GPU or RAM
         if attn_cache_tokens is None:
@@ -450,6 +452,7 @@ class Server:
                 quant_type=self.quant_type,
                 tensor_parallel_devices=self.tensor_parallel_devices,
                 should_validate_reachability=self.should_validate_reachability,
+                compile_blocks=self.compile_blocks,
                 start=True,
             )
             try:
@@ -553,6 +556,7 @@ class ModuleContainer(threading.Thread):
         quant_type: QuantType,
         tensor_parallel_devices: Sequence[torch.device],
         should_validate_reachability: bool,
+        compile_blocks: bool,
         **kwargs,
     ) -> ModuleContainer:
         module_uids = [f"{dht_prefix}{UID_DELIMITER}{block_index}" for block_index in block_indices]
@@ -628,6 +632,7 @@ class ModuleContainer(threading.Thread):
                     memory_cache=memory_cache,
                     backend_dtype=torch_dtype,
                     max_chunk_size_bytes=max_chunk_size_bytes,
+                    compile_forward=compile_blocks,
                     weights_path=path,
                     args_schema=(
                         BatchTensorDescriptor(
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from petals.server.backend import TransformerBackend
+
+
+def _update_old_layout(key_cache, value_cache, new_key, new_value, prefix_length):
+    """Reference implementation for the previous [batch, num_kv_heads, head_dim, max_length] key layout"""
+    _batch_size_times_num_kv_heads, head_dim, new_length = new_key.shape
+    new_key = new_key.view(*key_cache.shape[:3], new_length)
+    key_cache[:, :, :, prefix_length:new_length] = new_key[:, :, :, prefix_length:new_length]
+    new_value = new_value.view(*value_cache.shape[:2], new_length, head_dim)
+    value_cache[:, :, prefix_length:new_length, :] = new_value[:, :, prefix_length:new_length, :]
+
+
+@pytest.mark.parametrize("prefix_length,new_length", [(0, 5), (3, 4), (4, 9)])
+def test_cache_layout_roundtrip(prefix_length: int, new_length: int):
+    batch_size, num_kv_heads, head_dim, max_length = 2, 3, 8, 16
+    backend = SimpleNamespace(module=SimpleNamespace(module_shards=[None]))  # stands in for a single-shard block
+
+    # cache tensors as allocated from get_inference_cache_descriptors
+    key_cache = torch.zeros(batch_size, num_kv_heads, max_length, head_dim)
+    value_cache = torch.zeros(batch_size, num_kv_heads, max_length, head_dim)
+    old_key_cache = torch.zeros(batch_size, num_kv_heads, head_dim, max_length)
+    old_value_cache = torch.zeros(batch_size, num_kv_heads, max_length, head_dim)
+
+    # populate the prefix first, then append new tokens, as consecutive inference steps would
+    for step_prefix, step_length in [(0, prefix_length), (prefix_length, new_length)]:
+        if step_length == 0:
+            continue
+        # blocks return keys as [batch * num_kv_heads, head_dim, kv_length], values as [..., kv_length, head_dim]
+        new_key = torch.randn(batch_size * num_kv_heads, head_dim, step_length)
+        new_value = torch.randn(batch_size * num_kv_heads, step_length, head_dim)
+        TransformerBackend._update_cache_inplace(backend, (key_cache, value_cache), (new_key, new_value), step_prefix)
+        _update_old_layout(old_key_cache, old_value_cache, new_key, new_value, step_prefix)
+
+    key_past, value_past = TransformerBackend._select_layer_past(backend, (key_cache, value_cache), new_length)
+    assert key_past.shape == (batch_size * num_kv_heads, head_dim, new_length)
+    assert value_past.shape == (batch_size * num_kv_heads, new_length, head_dim)
+    assert torch.equal(key_past, old_key_cache.flatten(0, 1)[:, :, :new_length])
+    assert torch.equal(value_past, old_value_cache.flatten(0, 1)[:, :new_length])
+
+
+def test_reorder_cache_inplace():
+    key_cache, value_cache = torch.randn(3, 2, 5, 4), torch.randn(3, 2, 5, 4)
+    expected_keys, expected_values = key_cache[[2, 0, 0]], value_cache[[2, 0, 0]]
+    TransformerBackend._reorder_cache_inplace(None, (key_cache, value_cache), torch.tensor([2, 0, 0]))
+    assert torch.equal(key_cache, expected_keys)
+    assert torch.equal(value_cache, expected_values)